@@ -1,9 +1,12 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import polars as pl
+import duckdb
 import matplotlib.pyplot as plt
 from datetime import datetime
 from io import BytesIO
+from build_parquet import PARQUET_PATH, ensure_parquet
 
 # Set page config
 st.set_page_config(
@@ -42,26 +45,162 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Load data with caching
-@st.cache_data
+# Only the columns the dashboard reads are kept, so filters touch fewer bytes per row
+USED_COLUMNS = ['InvoiceNo', 'CustomerID', 'Country', 'Description', 'InvoiceDate', 'Quantity', 'UnitPrice',
+                'TotalPrice', 'Year', 'YearMonth', 'Day', 'Hour']
+
+# A single in-memory Polars frame is shared by every session and rerun, so
+# filters never re-read the Parquet file; it must never be modified in place
+@st.cache_resource
 def load_data():
-    df = pd.read_csv(r'D:\ETL Project\data\Online Retail.csv', encoding='ISO-8859-1', parse_dates=['InvoiceDate'])
+    df = pl.read_parquet(ensure_parquet(), columns=USED_COLUMNS)
+    # Widget bounds and options are computed once here rather than on every rerun
+    meta = dict(
+        min_date=df['InvoiceDate'].min(),
+        max_date=df['InvoiceDate'].max(),
+        min_qty=int(df['Quantity'].min()),
+        max_qty=int(df['Quantity'].max()),
+        min_price=float(df['UnitPrice'].min()),
+        max_price=float(df['UnitPrice'].max()),
+        countries=df['Country'].unique(maintain_order=True).to_list(),
+        products=df['Description'].unique(maintain_order=True).to_list(),
+    )
+    return df, meta
+
+# Segment membership depends only on the full dataset, so it is computed once
+@st.cache_data
+def load_segments():
+    lf = load_data()[0].lazy()
+    return {
+        'New': lf.group_by('CustomerID').agg(pl.col('InvoiceDate').min()).collect(),
+        'Repeat': lf.group_by('CustomerID').agg(pl.col('InvoiceNo').n_unique()).filter(pl.col('InvoiceNo') > 1).select('CustomerID').collect(),
+        'High Value': lf.group_by('CustomerID').agg(pl.col('TotalPrice').sum()).top_k(100, by='TotalPrice').select('CustomerID').collect(),
+    }
+
+# Aggregates are cached on filter_key, which fully determines the filtered data;
+# the leading underscore keeps Streamlit from hashing the frame/connection itself.
+# Every filter combination adds an entry, so these caches are bounded
+FILTER_CACHE_ENTRIES = 32
+
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def group_sum(_con, filter_key, by):
+    return _con.execute(
+        f"SELECT {by}, SUM(TotalPrice) AS TotalPrice FROM filtered GROUP BY {by} ORDER BY {by}"
+    ).df().set_index(by)['TotalPrice']
+
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def time_aggs(_con, filter_key):
+    # One scan of TotalPrice; the coarser views roll up the small per-timestamp result
+    daily = _con.execute("""
+        SELECT Year, YearMonth, InvoiceDate, SUM(TotalPrice) AS TotalPrice
+        FROM filtered
+        GROUP BY Year, YearMonth, InvoiceDate
+    """).df().set_index(['Year', 'YearMonth', 'InvoiceDate'])['TotalPrice']
+    return {
+        'Daily': daily.groupby('InvoiceDate', observed=True).sum(),
+        'Monthly': daily.groupby('YearMonth', observed=True).sum().rename(lambda v: f"{v // 100}-{v % 100:02d}"),
+        'Yearly': daily.groupby('Year', observed=True).sum(),
+    }
+
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def top_n(_con, filter_key, key, value, n):
+    # Top-N via ORDER BY ... LIMIT so DuckDB keeps a heap instead of sorting every group
+    result = _con.execute(
+        f"SELECT {key}, {value} AS value FROM filtered GROUP BY {key} ORDER BY value DESC LIMIT {n}"
+    ).df()
+    return result.set_index(key)['value']
+
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def kpis(_con, filter_key):
+    # All four KPI cards come from a single scan of the filtered data
+    return _con.execute("""
+        SELECT
+            COALESCE(SUM(TotalPrice), 0) AS sales,
+            COUNT(DISTINCT InvoiceNo) AS orders,
+            COUNT(DISTINCT CustomerID) AS customers,
+            COUNT(DISTINCT Description) AS products
+        FROM filtered
+    """).fetchone()
+
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def rfm_table(_con, filter_key):
+    # Recency is whole days between a customer's last purchase and the day after the latest invoice
+    return _con.execute("""
+        SELECT
+            CustomerID,
+            DATE_DIFF('second', MAX(InvoiceDate), (SELECT MAX(InvoiceDate) + INTERVAL 1 DAY FROM filtered)) // 86400 AS Recency,
+            COUNT(DISTINCT InvoiceNo) AS Frequency,
+            SUM(TotalPrice) AS Monetary
+        FROM filtered
+        GROUP BY CustomerID
+    """).df().set_index('CustomerID')
+
+def png_bytes(fig):
+    buf = BytesIO()
+    fig.savefig(buf, format='png', dpi=96, bbox_inches='tight')
+    plt.close(fig)
+    return buf.getvalue()
+
+# Matplotlib figures are drawn once per filter_key and served as cached PNG bytes
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def price_box_png(_prices, filter_key):
+    fig, ax = plt.subplots(figsize=(10, 5))
+    _prices.to_pandas().plot(kind='box', ax=ax, vert=False)
+    ax.set_title("Product Price Distribution")
+    ax.set_xlabel("Unit Price (£)")
+    return png_bytes(fig)
+
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def customer_pie_png(_cust_country, filter_key):
+    fig, ax = plt.subplots(figsize=(10, 10))
+    ax.pie(
+        _cust_country,
+        labels=_cust_country.index,
+        autopct='%1.1f%%',
+        startangle=90,
+        colors=plt.cm.Paired.colors
+    )
+    ax.set_title("Customer Distribution by Country (Top 10)")
+    return png_bytes(fig)
+
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def rfm_scatter_png(_rfm, filter_key):
+    fig, ax = plt.subplots(figsize=(10, 6))
+    scatter = ax.scatter(
+        _rfm['Recency'],
+        _rfm['Frequency'],
+        s=_rfm['Monetary']/50,
+        c=_rfm['Monetary'],
+        cmap='viridis',
+        alpha=0.6
+    )
+    ax.set_title("Customer RFM Analysis")
+    ax.set_xlabel("Recency (Days since last purchase)")
+    ax.set_ylabel("Frequency (Number of purchases)")
+    fig.colorbar(scatter, ax=ax, label='Monetary Value (£)')
+    return png_bytes(fig)
 
-    df['YearMonth'] = df['InvoiceDate'].dt.to_period('M').astype(str)
-    df['Year'] = df['InvoiceDate'].dt.year
-    df['Month'] = df['InvoiceDate'].dt.month_name()
-    df['Day'] = df['InvoiceDate'].dt.day_name()
-    df['Hour'] = df['InvoiceDate'].dt.hour
-    df['TotalPrice'] = df['UnitPrice'] * df['Quantity']
-    return df
+# Serialising the full frame is slow, so each export format is built once;
+# exports read every cached column, not just USED_COLUMNS. load_data() has already
+# checked the cache is current, so the file is read as-is
+@st.cache_data
+def export_bytes(fmt):
+    df = pd.read_parquet(PARQUET_PATH, engine='pyarrow')
+    buf = BytesIO()
+    if fmt == 'parquet':
+        df.to_parquet(buf, engine='pyarrow', compression='zstd', index=False)
+    else:
+        df.to_csv(buf, index=False)
+    return buf.getvalue()
 
-df = load_data()
+df, meta = load_data()
 
 # Sidebar with filters
 with st.sidebar:
     st.header("🔍 Filters")
     
     # Date range with quick select options
-    min_date, max_date = df['InvoiceDate'].min(), df['InvoiceDate'].max()
+    min_date, max_date = meta['min_date'], meta['max_date']
     date_range = st.date_input(
         "📅 Date Range",
         [min_date, max_date],
@@ -70,7 +209,7 @@ with st.sidebar:
     )
     
     # Country selection
-    all_countries = df['Country'].unique()
+    all_countries = meta['countries']
     selected_countries = st.multiselect(
         "🌍 Countries", 
         options=all_countries,
@@ -79,9 +218,10 @@ with st.sidebar:
     
     # Product selection
     if selected_countries:
-        available_products = df[df['Country'].isin(selected_countries)]['Description'].unique()
+        # Country is categorical, so is_in compares integer codes; mask only the column we need
+        available_products = df['Description'].filter(df['Country'].is_in(selected_countries)).unique(maintain_order=True).to_list()
     else:
-        available_products = df['Description'].unique()
+        available_products = meta['products']
         
     selected_products = st.multiselect(
         "📦 Products (Optional)", 
@@ -96,7 +236,7 @@ with st.sidebar:
     )
     
     # Quantity filter
-    min_qty, max_qty = int(df['Quantity'].min()), int(df['Quantity'].max())
+    min_qty, max_qty = meta['min_qty'], meta['max_qty']
     qty_range = st.slider(
         "🔢 Quantity Range", 
         min_qty, max_qty, 
@@ -104,7 +244,7 @@ with st.sidebar:
     )
     
     # Price filter
-    min_price, max_price = float(df['UnitPrice'].min()), float(df['UnitPrice'].max())
+    min_price, max_price = meta['min_price'], meta['max_price']
     price_range = st.slider(
         "💰 Unit Price Range (£)", 
         min_price, max_price, 
@@ -115,61 +255,69 @@ with st.sidebar:
     # Data download
     st.markdown("---")
     if st.button("💾 Export Data"):
-        csv = df.to_csv(index=False).encode('utf-8')
         st.download_button(
             label="⬇️ Download CSV",
-            data=csv,
+            data=export_bytes('csv'),
             file_name='retail_data.csv',
             mime='text/csv'
         )
+        st.download_button(
+            label="⬇️ Download Parquet",
+            data=export_bytes('parquet'),
+            file_name='retail_data.parquet',
+            mime='application/octet-stream'
+        )
 
 # Apply filters
-filtered_df = df[
-    (df['InvoiceDate'] >= pd.Timestamp(date_range[0])) & 
-    (df['InvoiceDate'] <= pd.Timestamp(date_range[1])) &
-    (df['Quantity'] >= qty_range[0]) & 
-    (df['Quantity'] <= qty_range[1]) &
-    (df['UnitPrice'] >= price_range[0]) & 
-    (df['UnitPrice'] <= price_range[1])
-]
+# All predicates are fused into a single lazy Polars query over the cached frame
+lf = df.lazy()
+predicate = (
+    pl.col('InvoiceDate').is_between(pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])) &
+    pl.col('Quantity').is_between(qty_range[0], qty_range[1]) &
+    pl.col('UnitPrice').is_between(price_range[0], price_range[1])
+)
 
 if selected_countries:
-    filtered_df = filtered_df[filtered_df['Country'].isin(selected_countries)]
+    predicate &= pl.col('Country').is_in(selected_countries)
     
 if selected_products:
-    filtered_df = filtered_df[filtered_df['Description'].isin(selected_products)]
+    predicate &= pl.col('Description').is_in(selected_products)
     
-if cust_segment == 'New':
-    first_purchases = df.groupby('CustomerID')['InvoiceDate'].min().reset_index()
-    filtered_df = filtered_df.merge(first_purchases, on=['CustomerID', 'InvoiceDate'])
-elif cust_segment == 'Repeat':
-    repeat_customers = df.groupby('CustomerID')['InvoiceNo'].nunique()
-    repeat_customers = repeat_customers[repeat_customers > 1].index
-    filtered_df = filtered_df[filtered_df['CustomerID'].isin(repeat_customers)]
-elif cust_segment == 'High Value':
-    high_value = df.groupby('CustomerID')['TotalPrice'].sum().nlargest(100).index
-    filtered_df = filtered_df[filtered_df['CustomerID'].isin(high_value)]
+filtered_lf = lf.filter(predicate)
+
+if cust_segment != 'All':
+    # 'New' matches on (CustomerID, first InvoiceDate); the other segments on CustomerID only
+    segment = load_segments()[cust_segment]
+    filtered_lf = filtered_lf.join(segment.lazy(), on=segment.columns, how='semi')
+
+filter_key = (tuple(date_range), tuple(selected_countries), tuple(selected_products), cust_segment, qty_range, price_range)
+filtered = filtered_lf.collect()
+
+# Group-by aggregations run as SQL directly over the filtered Polars frame
+con = duckdb.connect()
+con.register('filtered', filtered)
 
 # KPI Cards
 with st.container():
     st.subheader("📊 Performance Metrics")
     col1, col2, col3, col4 = st.columns(4)
+    total_sales, total_orders, total_customers, total_products = kpis(con, filter_key)
     
     with col1:
         st.markdown('<div class="metric-card"><div class="metric-title">Total Sales</div><div class="metric-value">£{:,.2f}</div></div>'.format(
-            filtered_df['TotalPrice'].sum()), unsafe_allow_html=True)
+            total_sales), unsafe_allow_html=True)
     
     with col2:
         st.markdown('<div class="metric-card"><div class="metric-title">Total Orders</div><div class="metric-value">{:,}</div></div>'.format(
-            filtered_df['InvoiceNo'].nunique()), unsafe_allow_html=True)
+            total_orders), unsafe_allow_html=True)
     
     with col3:
         st.markdown('<div class="metric-card"><div class="metric-title">Active Customers</div><div class="metric-value">{:,}</div></div>'.format(
-            filtered_df['CustomerID'].nunique()), unsafe_allow_html=True)
+            total_customers), unsafe_allow_html=True)
     
     with col4:
         st.markdown('<div class="metric-card"><div class="metric-title">Unique Products</div><div class="metric-value">{:,}</div></div>'.format(
-            filtered_df['Description'].nunique()), unsafe_allow_html=True)
+            total_products), unsafe_allow_html=True)
 
 # Main Dashboard Tabs
 tab1, tab2, tab3, tab4 = st.tabs(["📈 Trends", "📦 Products", "🌍 Geography", "👥 Customers"])
@@ -184,54 +332,31 @@ with tab1:
         horizontal=True
     )
     
-    if date_agg == "Daily":
-        date_col = 'InvoiceDate'
-        group_format = '%Y-%m-%d'
-    elif date_agg == "Monthly":
-        date_col = 'YearMonth'
-        group_format = '%Y-%m'
-    else:
-        date_col = 'Year'
-        group_format = '%Y'
-    
     # Sales trend data
-    sales_trend = filtered_df.groupby(date_col)['TotalPrice'].sum().reset_index()
+    sales_trend = time_aggs(con, filter_key)[date_agg]
     
     # Plot
-    fig, ax = plt.subplots(figsize=(12, 6))
-    ax.plot(sales_trend[date_col], sales_trend['TotalPrice'], color='#4CAF50', linewidth=2)
-    ax.set_title(f"Sales Trend ({date_agg} View)")
-    ax.set_xlabel("Date")
-    ax.set_ylabel("Sales (£)")
-    plt.xticks(rotation=45)
-    st.pyplot(fig)
+    st.caption(f"Sales Trend ({date_agg} View)")
+    st.line_chart(sales_trend, x_label="Date", y_label="Sales (£)", color='#4CAF50')
     
     # Additional trend views
     col1, col2 = st.columns(2)
     
     with col1:
         st.subheader("By Day of Week")
-        dow_sales = filtered_df.groupby('Day')['TotalPrice'].sum().reindex([
+        dow_sales = group_sum(con, filter_key, 'Day').reindex([
             'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'
         ])
         
-        fig2, ax2 = plt.subplots(figsize=(10, 5))
-        dow_sales.plot(kind='bar', color='#4CAF50', ax=ax2)
-        ax2.set_title("Sales by Day of Week")
-        ax2.set_ylabel("Sales (£)")
-        plt.xticks(rotation=45)
-        st.pyplot(fig2)
+        st.caption("Sales by Day of Week")
+        st.bar_chart(dow_sales, y_label="Sales (£)", color='#4CAF50', sort=False)
     
     with col2:
         st.subheader("By Hour of Day")
-        hour_sales = filtered_df.groupby('Hour')['TotalPrice'].sum()
+        hour_sales = group_sum(con, filter_key, 'Hour')
         
-        fig3, ax3 = plt.subplots(figsize=(10, 5))
-        hour_sales.plot(kind='line', color='#4CAF50', marker='o', ax=ax3)
-        ax3.set_title("Sales by Hour of Day")
-        ax3.set_ylabel("Sales (£)")
-        ax3.set_xlabel("Hour")
-        st.pyplot(fig3)
+        st.caption("Sales by Hour of Day")
+        st.line_chart(hour_sales, x_label="Hour", y_label="Sales (£)", color='#4CAF50')
 
 with tab2:
     st.subheader("Product Performance")
@@ -244,91 +369,52 @@ with tab2:
     )
     
     if metric == "Revenue":
-        top_products = filtered_df.groupby('Description')['TotalPrice'].sum().nlargest(10)
+        top_products = top_n(con, filter_key, 'Description', 'SUM(TotalPrice)', 10)
         y_label = "Revenue (£)"
     elif metric == "Quantity":
-        top_products = filtered_df.groupby('Description')['Quantity'].sum().nlargest(10)
+        top_products = top_n(con, filter_key, 'Description', 'SUM(Quantity)', 10)
         y_label = "Quantity Sold"
     else:
-        top_products = filtered_df.groupby('Description')['InvoiceNo'].nunique().nlargest(10)
+        top_products = top_n(con, filter_key, 'Description', 'COUNT(DISTINCT InvoiceNo)', 10)
         y_label = "Number of Orders"
     
     # Plot top products
-    fig, ax = plt.subplots(figsize=(12, 6))
-    top_products.sort_values().plot(kind='barh', color='#4CAF50', ax=ax)
-    ax.set_title(f"Top 10 Products by {metric}")
-    ax.set_xlabel(y_label)
-    st.pyplot(fig)
+    st.caption(f"Top 10 Products by {metric}")
+    st.bar_chart(top_products, horizontal=True, x_label="Product", y_label=y_label, color='#4CAF50', sort=False)
     
     # Price distribution
     st.subheader("Price Distribution")
-    fig2, ax2 = plt.subplots(figsize=(10, 5))
-    filtered_df['UnitPrice'].plot(kind='box', ax=ax2, vert=False)
-    ax2.set_title("Product Price Distribution")
-    ax2.set_xlabel("Unit Price (£)")
-    st.pyplot(fig2)
+    st.image(price_box_png(filtered['UnitPrice'], filter_key))
 
 with tab3:
     st.subheader("Geographic Analysis")
     
+    # Group by Country to get total sales; both charts share this cached aggregate
+    country_sales = group_sum(con, filter_key, 'Country').sort_values(ascending=False)
+    
     if len(selected_countries) > 1 or not selected_countries:
         # Country sales
-        country_sales = filtered_df.groupby('Country')['TotalPrice'].sum().nlargest(20)
-        
-        fig, ax = plt.subplots(figsize=(12, 6))
-        country_sales.plot(kind='bar', color='#4CAF50', ax=ax)
-        ax.set_title("Sales by Country")
-        ax.set_ylabel("Sales (£)")
-        plt.xticks(rotation=45)
-        st.pyplot(fig)
+        st.caption("Sales by Country")
+        st.bar_chart(country_sales.head(20), y_label="Sales (£)", color='#4CAF50', sort=False)
     else:
         st.info("Select multiple countries to compare")
     
-
-  # Group by Country to get total sales  
-
-country_sales = filtered_df.groupby('Country')['TotalPrice'].sum().sort_values(ascending=False).reset_index()
-fig2, ax2 = plt.subplots(figsize=(12, 6))
-ax2.bar(country_sales['Country'], country_sales['TotalPrice'], color='teal')
-ax2.set_title("Total Sales by Country")
-ax2.set_xlabel("Country")
-ax2.set_ylabel("Sales (£)")
-plt.xticks(rotation=45)
-plt.tight_layout()
-st.pyplot(fig2)
-
+    st.caption("Total Sales by Country")
+    st.bar_chart(country_sales, x_label="Country", y_label="Sales (£)", color='#008080', sort=False)
 
 with tab4:
     st.subheader("Customer Insights")
     
     # Customer distribution by country
-    cust_country = filtered_df.groupby('Country')['CustomerID'].nunique().nlargest(10)
+    cust_country = top_n(con, filter_key, 'Country', 'COUNT(DISTINCT CustomerID)', 10)
     
-    fig, ax = plt.subplots(figsize=(10, 10))
-    ax.pie(
-        cust_country,
-        labels=cust_country.index,
-        autopct='%1.1f%%',
-        startangle=90,
-        colors=plt.cm.Paired.colors
-    )
-    ax.set_title("Customer Distribution by Country (Top 10)")
-    st.pyplot(fig)
+    st.image(customer_pie_png(cust_country, filter_key))
     
     # Customer RFM analysis (if not filtered to new customers)
     if cust_segment != 'New':
         st.subheader("Customer RFM Analysis")
         
-        last_date = filtered_df['InvoiceDate'].max() + pd.Timedelta(days=1)
-        rfm = filtered_df.groupby('CustomerID').agg({
-            'InvoiceDate': lambda x: (last_date - x.max()).days,
-            'InvoiceNo': 'nunique',
-            'TotalPrice': 'sum'
-        }).rename(columns={
-            'InvoiceDate': 'Recency',
-            'InvoiceNo': 'Frequency',
-            'TotalPrice': 'Monetary'
-        })
+        rfm = rfm_table(con, filter_key)
         
         # Display RFM table
         st.dataframe(
@@ -341,20 +427,7 @@ with tab4:
         )
         
         # RFM scatter plot
-        fig2, ax2 = plt.subplots(figsize=(10, 6))
-        scatter = ax2.scatter(
-            rfm['Recency'],
-            rfm['Frequency'],
-            s=rfm['Monetary']/50,
-            c=rfm['Monetary'],
-            cmap='viridis',
-            alpha=0.6
-        )
-        ax2.set_title("Customer RFM Analysis")
-        ax2.set_xlabel("Recency (Days since last purchase)")
-        ax2.set_ylabel("Frequency (Number of purchases)")
-        plt.colorbar(scatter, label='Monetary Value (£)')
-        st.pyplot(fig2)
+        st.image(rfm_scatter_png(rfm, filter_key))
     else:
         st.info("RFM analysis not available for new customers only")
 
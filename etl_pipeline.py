@@ -1,16 +1,25 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import numexpr as ne
 import plotly.express as px
-import plotly.graph_objects as go
 import io
+from build_parquet import DTYPES, ensure_parquet
 
 st.set_page_config(page_title="📦 Interactive Retail Sales Dashboard", layout="wide")
 
 st.markdown("<h1 style='text-align: center; color: #4CAF50;'>📦 Online Retail Sales Dashboard (Interactive)</h1>", unsafe_allow_html=True)
 
-@st.cache_data
+# Only the columns this app reads are loaded
+USED_COLUMNS = ['InvoiceNo', 'CustomerID', 'Country', 'Description', 'InvoiceDate', 'Quantity', 'TotalPrice']
+
+# A single in-memory copy is shared by every session and rerun, so nothing is
+# unpickled per rerun; it must never be modified in place
+@st.cache_resource
 def load_data():
-    df = pd.read_csv('output/cleaned_online_retail.csv', parse_dates=['InvoiceDate'])
+    df = pd.read_parquet(ensure_parquet(), engine='pyarrow', columns=USED_COLUMNS)
+    # No-op for a current cache; keeps the dtypes defined in one place
+    df = df.astype({c: DTYPES[c] for c in df.columns if c in DTYPES})
     return df
 
 df = load_data()
@@ -21,7 +30,10 @@ with st.sidebar:
     min_date, max_date = df['InvoiceDate'].min(), df['InvoiceDate'].max()
     date_range = st.date_input("📅 Date Range", [min_date, max_date])
 
-    df = df[(df['InvoiceDate'] >= pd.Timestamp(date_range[0])) & (df['InvoiceDate'] <= pd.Timestamp(date_range[1]))]
+    # numexpr evaluates both bounds in one pass without materialising intermediate masks
+    dates = df['InvoiceDate'].to_numpy()
+    start, end = (np.datetime64(d).astype(dates.dtype).astype(np.int64) for d in date_range)
+    df = df[ne.evaluate('(d >= start) & (d <= end)', local_dict={'d': dates.view(np.int64), 'start': start, 'end': end})]
 
     countries = st.multiselect("🌍 Select Country", df['Country'].unique(), default=['United Kingdom'])
     df = df[df['Country'].isin(countries)]
@@ -32,16 +44,24 @@ with st.sidebar:
 
     cust_id = st.text_input("👥 CustomerID (Optional)")
     if cust_id:
-        df = df[df['CustomerID'].astype(str).str.contains(cust_id)]
+        # A numeric ID is matched exactly instead of regex-searching every stringified row
+        try:
+            df = df[df['CustomerID'] == float(cust_id)]
+        except ValueError:
+            df = df[df['CustomerID'].astype('string').str.contains(cust_id, regex=False, na=False)]
+
+    if df.empty:
+        st.warning("No sales match the selected filters.")
+        st.stop()
 
     quantity_min, quantity_max = st.slider("🔢 Quantity Range", int(df['Quantity'].min()), int(df['Quantity'].max()), (int(df['Quantity'].min()), int(df['Quantity'].max())))
-    df = df[(df['Quantity'] >= quantity_min) & (df['Quantity'] <= quantity_max)]
+    df = df[ne.evaluate('(q >= quantity_min) & (q <= quantity_max)', local_dict={'q': df['Quantity'].to_numpy(), 'quantity_min': quantity_min, 'quantity_max': quantity_max})]
 
 # KPIs
 with st.container():
     st.subheader("📊 Key Performance Indicators")
     col1, col2, col3, col4 = st.columns(4)
-    col1.metric("💰 Total Sales (£)", f"{df['TotalPrice'].sum():,.2f}")
+    col1.metric("💰 Total Sales (£)", f"{df['TotalPrice'].to_numpy().sum(dtype=np.float64):,.2f}")
     col2.metric("🛒 Orders", df['InvoiceNo'].nunique())
     col3.metric("👥 Customers", df['CustomerID'].nunique())
     col4.metric("📦 Products", df['Description'].nunique())
@@ -51,30 +71,31 @@ tab1, tab2, tab3, tab4 = st.tabs(["🏆 Top Products", "📅 Sales Over Time", "
 
 with tab1:
     st.subheader("🏆 Top 10 Products by Sales")
-    top_products = df.groupby('Description')['TotalPrice'].sum().sort_values(ascending=False).head(10).reset_index()
+    product_sales = df.groupby('Description', observed=True)['TotalPrice'].sum()
+    # Partially select the top 10 instead of sorting every product
+    top_idx = np.argpartition(-product_sales.to_numpy(), min(10, len(product_sales)) - 1)[:10]
+    top_products = product_sales.iloc[top_idx].sort_values(ascending=False).reset_index()
     fig1 = px.bar(top_products, x='TotalPrice', y='Description', orientation='h', color='TotalPrice', color_continuous_scale='viridis', title="Top 10 Products by Sales")
     fig1.update_layout(yaxis_title='Product', xaxis_title='Total Sales (£)', height=500)
     st.plotly_chart(fig1, use_container_width=True)
 
 with tab2:
     st.subheader("📅 Sales Over Time")
-    sales_over_time = df.groupby('InvoiceDate')['TotalPrice'].sum().reset_index()
+    sales_over_time = df.groupby('InvoiceDate', observed=True)['TotalPrice'].sum().reset_index()
     fig2 = px.line(sales_over_time, x='InvoiceDate', y='TotalPrice', title="Sales Trend Over Time", markers=True)
     fig2.update_layout(xaxis_title='Date', yaxis_title='Total Sales (£)', height=500)
     st.plotly_chart(fig2, use_container_width=True)
 
 with tab3:
     st.subheader("🌍 Sales Over Time by Country")
-    fig3 = go.Figure()
-    for c in df['Country'].unique():
-        country_sales = df[df['Country'] == c].groupby('InvoiceDate')['TotalPrice'].sum().reset_index()
-        fig3.add_trace(go.Scatter(x=country_sales['InvoiceDate'], y=country_sales['TotalPrice'], mode='lines+markers', name=c))
-    fig3.update_layout(title="Sales Over Time by Country", xaxis_title='Date', yaxis_title='Total Sales (£)', height=500)
+    country_sales = df.groupby(['InvoiceDate', 'Country'], observed=True)['TotalPrice'].sum().reset_index()
+    fig3 = px.line(country_sales, x='InvoiceDate', y='TotalPrice', color='Country', markers=True, title="Sales Over Time by Country")
+    fig3.update_layout(xaxis_title='Date', yaxis_title='Total Sales (£)', height=500)
     st.plotly_chart(fig3, use_container_width=True)
 
 with tab4:
     st.subheader("🥧 Customer Distribution by Country")
-    customer_distribution = df.groupby('Country')['CustomerID'].nunique().sort_values(ascending=False)
+    customer_distribution = df.groupby('Country', observed=True)['CustomerID'].nunique().sort_values(ascending=False)
     top5 = customer_distribution.head(5)
     others = customer_distribution.iloc[5:].sum()
     final_distribution = pd.concat([top5, pd.Series({'Others': others})]).reset_index()